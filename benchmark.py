@@ -0,0 +1,244 @@
+"""
+Benchmark of the filtering pipeline
+
+Feeds synthetic messages through scanner.handler using fake Telethon events
+and a temporary SQLite database, then reports throughput, per-stage latency
+percentiles and peak RSS.
+
+Example:
+    py benchmark.py --users 20 --sources 5 --filters 6 --history 50 --messages 200 --out bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+from bench_utils import percentiles, peak_rss_mb, git_commit
+
+# config.py requires telegram credentials, none are used here
+os.environ.setdefault("API_ID", "0")
+os.environ.setdefault("API_HASH", "benchmark")
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+# --- SYNTHETIC CORPUS ---
+
+VOCAB = {
+    "ru": {
+        "subjects": ["Правительство", "Центробанк", "Команда", "Учёные", "Компания", "Мэрия", "Полиция", "Министерство"],
+        "verbs": ["объявило", "сообщила", "представила", "запустила", "опровергла", "обсудила", "повысила", "отменила"],
+        "objects": ["новый закон", "ключевую ставку", "футбольный матч", "исследование климата", "выпуск смартфона",
+                    "ремонт дорог", "цены на нефть", "курс рубля", "выборы", "вакцину"],
+        "tails": ["сегодня утром", "на пресс-конференции", "в Москве", "по данным источников", "после долгих споров"],
+    },
+    "en": {
+        "subjects": ["The government", "The central bank", "The team", "Scientists", "The company", "City hall", "Police"],
+        "verbs": ["announced", "reported", "unveiled", "launched", "denied", "discussed", "raised", "cancelled"],
+        "objects": ["a new law", "the key rate", "a football match", "a climate study", "a smartphone release",
+                    "road repairs", "oil prices", "the exchange rate", "the elections", "a vaccine"],
+        "tails": ["this morning", "at a press conference", "in London", "according to sources", "after long debates"],
+    },
+}
+
+KEYWORDS = ["закон", "ставка", "матч", "нефть", "выборы", "вакцина", "law", "rate", "match", "oil", "vaccine"]
+BLOCKS = ["реклама", "спойлер", "sponsored", "giveaway"]
+SHORT_TOPICS = ["politics", "sports", "economy", "science", "технологии", "медицина"]
+LONG_TOPICS = [
+    "decisions of the central bank about interest rates and inflation",
+    "новости о выборах и решениях правительства в регионах",
+    "football championships, transfers and match results of top clubs",
+]
+EMOJIS = ["🔥", "⚡️", "📈", "🇷🇺", "❗️", "👇"]
+
+def make_sentence(rng, lang):
+    v = VOCAB[lang]
+    return f"{rng.choice(v['subjects'])} {rng.choice(v['verbs'])} {rng.choice(v['objects'])} {rng.choice(v['tails'])}."
+
+def make_post(rng, min_sentences=1, max_sentences=8):
+    """
+    Random multilingual news post, optionally with emojis and an ad line
+    """
+    lang = rng.choice(["ru", "en"])
+    sentences = [make_sentence(rng, lang) for _ in range(rng.randint(min_sentences, max_sentences))]
+    if rng.random() < 0.3:
+        sentences.insert(0, rng.choice(EMOJIS))
+    if rng.random() < 0.1:
+        sentences.append(rng.choice(BLOCKS))
+    return " ".join(sentences)
+
+def make_filters(rng, count):
+    filters = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.5:
+            filters.append(("keyword", rng.choice(KEYWORDS)))
+        elif kind < 0.7:
+            filters.append(("block", rng.choice(BLOCKS)))
+        elif kind < 0.9:
+            filters.append(("topic", rng.choice(SHORT_TOPICS)))
+        else:
+            filters.append(("topic", rng.choice(LONG_TOPICS)))
+    return filters
+
+# --- FAKE TELETHON EVENT ---
+
+class FakeChat:
+    def __init__(self, username):
+        self.username = username
+
+class FakeMessage:
+    def __init__(self, message):
+        self.message = message
+
+class FakeEvent:
+    """
+    Stand-in for telethon events.NewMessage.Event with the attributes scanner.handler uses
+    """
+    def __init__(self, event_id, username, text):
+        self.id = event_id
+        self.text = text
+        self.message = FakeMessage(text)
+        self._chat = FakeChat(username)
+
+    async def get_chat(self):
+        return self._chat
+
+# --- MEASUREMENTS ---
+
+class StageTimer:
+    """
+    Collects wall time of every call of the wrapped coroutine functions
+    """
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, name, func):
+        samples = self.samples.setdefault(name, [])
+
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        return wrapper
+
+    def summary(self):
+        return {name: percentiles(values) for name, values in self.samples.items()}
+
+# --- SCENARIO ---
+
+async def populate_db(db, rng, args):
+    await db.init_db()
+    sources = [f"bench_source_{i}" for i in range(args.sources)]
+    source_ids = [await db.add_source(name) for name in sources]
+
+    for uid in range(1, args.users + 1):
+        await db.add_user(uid)
+        for sid in rng.sample(source_ids, min(args.subscriptions, len(source_ids))):
+            await db.subscribe_user(uid, sid)
+        for ft, val in make_filters(rng, args.filters):
+            await db.add_filter(uid, ft, val)
+        for _ in range(args.history):
+            await db.add_to_history(uid, make_post(rng))
+    return sources
+
+async def run(args):
+    rng = random.Random(args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix="filternews_bench_")
+    # importing scanner opens its telethon session, keep it away from the real one
+    os.environ["SCANNER_SESSION"] = os.path.join(tmp_dir, "scanner_session")
+
+    import database as db
+    db.DB_NAME = os.path.join(tmp_dir, "bench.db")
+
+    print("Loading scanner and models.")
+    load_start = time.perf_counter()
+    import scanner
+    await scanner.engine.wait_ready()
+    load_time = time.perf_counter() - load_start
+
+    sources = await populate_db(db, rng, args)
+    events = [
+        FakeEvent(i + 1, rng.choice(sources), make_post(rng))
+        for i in range(args.messages + args.warmup)
+    ]
+
+    timer = StageTimer()
+    engine = scanner.engine
+    engine.process_source_message = timer.wrap("process_source", engine.process_source_message)
+    engine.is_duplicate = timer.wrap("is_duplicate", engine.is_duplicate)
+    handler = timer.wrap("handler", scanner.handler)
+
+    # warm-up messages are not measured
+    for event in events[:args.warmup]:
+        await handler(event)
+    for samples in timer.samples.values():
+        samples.clear()
+
+    print(f"Running {args.messages} messages.")
+    start = time.perf_counter()
+    for event in events[args.warmup:]:
+        await handler(event)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scenario": {
+            "users": args.users,
+            "sources": args.sources,
+            "subscriptions": args.subscriptions,
+            "filters": args.filters,
+            "history": args.history,
+            "messages": args.messages,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "model_load_s": load_time,
+        "elapsed_s": elapsed,
+        "messages_per_s": args.messages / elapsed if elapsed else None,
+        "stages": timer.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def print_report(result):
+    print(f"\nCommit: {result['commit']}  Scenario: {result['scenario']}")
+    print(f"Model load: {result['model_load_s']:.1f} s")
+    print(f"Throughput: {result['messages_per_s']:.2f} msg/s ({result['elapsed_s']:.1f} s)")
+    if result["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {result['peak_rss_mb']:.0f} MB")
+    else:
+        print("Peak RSS: not available on this platform")
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["stages"].items():
+        if not stats["count"]:
+            continue
+        print(f"{name:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the filtering pipeline on synthetic messages")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--sources", type=int, default=5)
+    parser.add_argument("--subscriptions", type=int, default=3, help="sources per user")
+    parser.add_argument("--filters", type=int, default=5, help="filters per user")
+    parser.add_argument("--history", type=int, default=20, help="sent history entries per user")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="save results to this JSON file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Saved to {args.out}")
@@ -1,16 +1,26 @@
 import asyncio
 import logging
+import time
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 import config
 import database as db
+import metrics
 import platform
+import html
+
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
+log = logging.getLogger("bot")
 
 if platform.system() == 'Windows':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-bot = Bot(token=config.BOT_TOKEN)
+session = AiohttpSession(api=TelegramAPIServer.from_base(config.BOT_API_URL)) if config.BOT_API_URL else None
+bot = Bot(token=config.BOT_TOKEN, session=session)
 dp = Dispatcher()
 
 # --- TEXTS ---
@@ -33,6 +43,7 @@ TEXT_START = (
     "/add_block &lt;word&gt; - Hide posts with this word\n"
     "/list_blocks - List of blocked words\n\n"
     "⚙️ <b>Other:</b>\n"
+    "/digest &lt;minutes&gt; [items] - Get matches grouped in one message\n"
     "/clear_all - Full reset of all data\n"
     "/help - Help\n\n"
 )
@@ -52,6 +63,9 @@ TEXT_HELP = (
     "/add_block &lt;word&gt;\n"
     "/remove_block &lt;word&gt;\n"
     "/list_blocks\n\n"
+    "<b>📰 Digest:</b>\n"
+    "/digest &lt;minutes&gt; [items]\n"
+    "/digest off\n\n"
     "<b>🗑 Reset settings:</b>\n"
     "/clear_all"
 )
@@ -142,6 +156,30 @@ async def rm_blk(m: types.Message):
     await db.remove_filter(m.from_user.id, 'block', blk)
     await m.answer(f"🗑 Unblocked word: {blk}")
 
+# --- DIGEST ---
+
+@dp.message(Command("digest"))
+async def digest_cmd(m: types.Message):
+    args = m.text.split()[1:]
+    if not args:
+        minutes, items = await db.get_digest_mode(m.from_user.id)
+        if not minutes and not items:
+            return await m.answer("📰 Digest is off. Every match is sent immediately.\
+                                  \nExample: /digest 30 20")
+        return await m.answer(f"📰 Digest: every {minutes} min or every {items or '∞'} items.")
+
+    if args[0].lower() == "off":
+        await db.set_digest_mode(m.from_user.id, 0, 0)
+        return await m.answer("🔔 Digest is off. Every match is sent immediately.")
+
+    if not all(a.isdigit() for a in args[:2]) or int(args[0]) < 1:
+        return await m.answer("⚠️ Write the interval in minutes and optionally the number of items.\
+                              \nExample: /digest 30 20")
+    minutes = int(args[0])
+    items = int(args[1]) if len(args) > 1 else 0
+    await db.set_digest_mode(m.from_user.id, minutes, items)
+    await m.answer(f"📰 Digest is on: every {minutes} min" + (f" or every {items} items." if items else "."))
+
 @dp.message(Command("clear_all"))
 async def clear_all(m: types.Message):
     await db.clear_all_data(m.from_user.id)
@@ -290,36 +328,111 @@ async def process_del(cb: CallbackQuery):
 
 # --- NOTIFICATION WORKER ---
 
+# telegram limit for a single text message
+MAX_MESSAGE_LEN = 4096
+# length of the news preview in a digest entry
+DIGEST_PREVIEW_LEN = 150
+# length of the reason (keyword or topic) in a digest group header
+DIGEST_REASON_LEN = 200
+
+def _shorten(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def build_digest_messages(rows):
+    """
+    Build digest messages from queued notifications.
+    Groups entries by source and reason and splits them 
+    so that every message fits into MAX_MESSAGE_LEN.
+    The digest header stays with the first group, and a group
+    continued in the next message repeats its source/reason header
+    """
+    groups = {}
+    for _, _, text, source, reason, link in rows:
+        groups.setdefault((source, reason), []).append((text, link))
+
+    messages = []
+    current = f"📰 <b>News digest: {len(rows)} new</b>\n"
+    has_entries = False
+    for (source, reason), entries in sorted(groups.items()):
+        # reason and preview are cut before escaping, so every block stays far below the limit
+        group_header = f"\nSource: @{source} · <u>{html.escape(_shorten(reason, DIGEST_REASON_LEN))}</u>\n"
+        header_sent = False
+        for text, link in entries:
+            preview = html.escape(_shorten(text, DIGEST_PREVIEW_LEN).replace("\n", " "))
+            entry = f"• {preview} <a href=\"{link}\">🔗</a>\n"
+            block = entry if header_sent else group_header + entry
+            if has_entries and len(current) + len(block) > MAX_MESSAGE_LEN:
+                messages.append(current)
+                current = ""
+                block = group_header.lstrip("\n") + entry
+            current += block
+            header_sent = True
+            has_entries = True
+    if has_entries:
+        messages.append(current)
+    return messages
+
+async def send_notification(user_id, text, kind, **kwargs):
+    """
+    Send a message, waiting out Telegram flood limits, and record delivery metrics
+    """
+    while True:
+        start = time.perf_counter()
+        try:
+            await bot.send_message(user_id, text, parse_mode="HTML", **kwargs)
+            metrics.SEND_SECONDS.observe(time.perf_counter() - start)
+            metrics.SENT.inc(kind=kind, result="ok")
+            return
+        except TelegramRetryAfter as e:
+            log.warning("Flood limit, wait %s seconds", e.retry_after)
+            metrics.FLOOD_WAIT_SECONDS.inc(e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            metrics.SENT.inc(kind=kind, result="error")
+            log.warning("Error sending %s: %s", kind, e)
+            return
+
 async def notification_worker():
-    print("Notification worker started")
+    log.info("Notification worker started")
     while True:
+        depth, oldest_age = await db.get_queue_stats()
+        metrics.QUEUE_DEPTH.set(depth)
+        metrics.QUEUE_AGE_SECONDS.set(oldest_age)
+
         notifications = await db.get_and_clear_notifications()
         
         for note in notifications:
             user_id, text, source, reason, link = note[1], note[2], note[3], note[4], note[5]
             
-            try:
-                await bot.send_message(
-                    user_id, 
-                    f"🔔 <b>New news for you!</b>\
-                        \n<u>{reason}</u>\
-                        \nSource: @{source}\
-                        \n\n{text[:300]}\n\n\
-                        🔗 <a href=\"{link}\"><b>Read original</b></a>", 
-                    parse_mode="HTML"
-                )
-                
-                await asyncio.sleep(0.5)
-            except Exception as e:
-                print(f"Error sending: {e}")
+            await send_notification(
+                user_id, 
+                f"🔔 <b>New news for you!</b>\
+                    \n<u>{reason}</u>\
+                    \nSource: @{source}\
+                    \n\n{text[:300]}\n\n\
+                    🔗 <a href=\"{link}\"><b>Read original</b></a>", 
+                "notification"
+            )
+            
+            await asyncio.sleep(config.SEND_INTERVAL)
+
+        # digest users get all their collected matches at once
+        digests = await db.get_and_clear_due_digests()
+
+        for user_id, rows in digests.items():
+            for message in build_digest_messages(rows):
+                await send_notification(user_id, message, "digest", disable_web_page_preview=True)
+
+                await asyncio.sleep(config.SEND_INTERVAL)
         
         await asyncio.sleep(2)
 
 async def main():
     await db.init_db()
+    await metrics.start_exporter("bot", port_offset=1)
     asyncio.create_task(notification_worker())
     
-    print("Running BOT.PY")
+    log.info("Running BOT.PY")
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
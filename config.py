@@ -6,5 +6,39 @@ load_dotenv()
 API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# telethon session file of the scanner (path without .session)
+SCANNER_SESSION = os.getenv("SCANNER_SESSION", "scanner_session")
+# custom Bot API server (e.g. the fake one from loadtest_delivery.py), empty = api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "")
 ML_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
-ML_MODEL_NAME_TOPICS = "MoritzLaurer/mDeBERTa-v3-base-mnli-xnli"
\ No newline at end of file
+ML_MODEL_NAME_TOPICS = "MoritzLaurer/mDeBERTa-v3-base-mnli-xnli"
+# models are pinned here as safetensors after the first download, no hub lookups afterwards
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+# NLI premise chunk size in tokens, long posts are split and scores max-pooled
+NLI_CHUNK_TOKENS = int(os.getenv("NLI_CHUNK_TOKENS", "256"))
+# inference processes forked after loading, sharing model weights (0 = run models in threads)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+# torch threads per inference process
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1"))
+
+# pause between two sent notifications or digest messages, in seconds
+SEND_INTERVAL = float(os.getenv("SEND_INTERVAL", "0.5"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# metrics: HTTP port for scanner (bot uses +1, manager +2), 0 disables
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# metrics: directory for periodic <process>.prom dumps, empty disables
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "15"))
+
+
+# profiler: PROFILE=1 enables it at start, SIGUSR2 toggles it at runtime
+PROFILE = os.getenv("PROFILE", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# seconds between stack samples and between dumps
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+PROFILE_DUMP_INTERVAL = float(os.getenv("PROFILE_DUMP_INTERVAL", "60"))
+# number of slowest messages kept in slowest.log
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "20"))
@@ -1,16 +1,21 @@
 import aiosqlite
 import asyncio
 import time
+from metrics import db_call
 
 DB_NAME = "bot_data.db"
 
 TIMEOUT = 5.0
 
+@db_call
 async def init_db():
     async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
         await db.execute("PRAGMA journal_mode=WAL;") 
         
         await db.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY)")
+        # digest settings (0 = disabled, send every match immediately)
+        await _add_column(db, "users", "digest_minutes", "INTEGER DEFAULT 0")
+        await _add_column(db, "users", "digest_items", "INTEGER DEFAULT 0")
         await db.execute("CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, username TEXT UNIQUE)")
         await db.execute("CREATE TABLE IF NOT EXISTS subscriptions (user_id INTEGER, source_id INTEGER, UNIQUE(user_id, source_id))")
         await db.execute("CREATE TABLE IF NOT EXISTS filters (user_id INTEGER, filter_type TEXT, value TEXT)")
@@ -26,6 +31,7 @@ async def init_db():
                 link TEXT
             )
         """)
+        await _add_column(db, "notification_queue", "created_at", "REAL")
         
         # --- HISTORY OF SENT MESSAGES  ---
         # to avoid sending duplicates
@@ -40,7 +46,17 @@ async def init_db():
         
         await db.commit()
 
+async def _add_column(db, table, column, definition):
+    """
+    Add a column to an existing table if it is missing (lightweight migration)
+    """
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = [r[1] for r in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 # --- HISTORY ---
+@db_call
 async def add_to_history(user_id, text):
     """
     Add text to the sent history for the user with a timestamp
@@ -52,6 +68,7 @@ async def add_to_history(user_id, text):
         )
         await db.commit()
 
+@db_call
 async def get_user_history(user_id):
     """
     Get texts sent to the user in the last 24 hours
@@ -62,6 +79,7 @@ async def get_user_history(user_id):
             rows = await cursor.fetchall()
             return [r[0] for r in rows]
 
+@db_call
 async def cleanup_history():
     """
     Delete history entries older than 24 hours
@@ -72,34 +90,96 @@ async def cleanup_history():
         await db.commit()
 
 # --- NOTIFICATION QUEUE ---
+@db_call
 async def add_notification(user_id, text, source, reason, link):
     """
     Add a notification to the queue
     """
     async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
         await db.execute(
-            "INSERT INTO notification_queue (user_id, text, source, reason, link) VALUES (?, ?, ?, ?, ?)",
-            (user_id, text, source, reason, link)
+            "INSERT INTO notification_queue (user_id, text, source, reason, link, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, text, source, reason, link, time.time())
         )
         await db.commit()
 
+async def _delete_notifications(db, rows):
+    """
+    Delete fetched notification rows from the queue
+    """
+    ids = [r[0] for r in rows]
+    await db.execute(f"DELETE FROM notification_queue WHERE id IN ({','.join(map(str, ids))})")
+
+@db_call
 async def get_and_clear_notifications():
     """
-    Get all notifications from the queue and clear them
+    Get all notifications of users without digest mode from the queue and clear them
     """
     async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
-        async with db.execute("SELECT id, user_id, text, source, reason, link FROM notification_queue") as cursor:
+        async with db.execute("""
+            SELECT q.id, q.user_id, q.text, q.source, q.reason, q.link
+            FROM notification_queue q LEFT JOIN users u ON q.user_id = u.user_id
+            WHERE COALESCE(u.digest_minutes, 0) = 0 AND COALESCE(u.digest_items, 0) = 0
+            ORDER BY q.id
+        """) as cursor:
             rows = await cursor.fetchall()
         
         if rows:
-            ids = [r[0] for r in rows]
-            await db.execute(f"DELETE FROM notification_queue WHERE id IN ({','.join(map(str, ids))})")
+            await _delete_notifications(db, rows)
             await db.commit()
     return rows
 
+@db_call
+async def get_and_clear_due_digests():
+    """
+    Get queued notifications of digest users whose digest is due and clear them.
+    A digest is due when the user collected digest_items notifications
+    or the oldest queued notification waited for digest_minutes.
+    Returns {user_id: [rows]}
+    """
+    now = time.time()
+    async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
+        async with db.execute("""
+            SELECT u.user_id, u.digest_minutes, u.digest_items, MIN(COALESCE(q.created_at, 0)), COUNT(q.id)
+            FROM users u JOIN notification_queue q ON q.user_id = u.user_id
+            WHERE u.digest_minutes > 0 OR u.digest_items > 0
+            GROUP BY u.user_id
+        """) as cursor:
+            candidates = await cursor.fetchall()
+
+        due_users = [
+            uid for uid, minutes, items, oldest_at, count in candidates
+            if (items > 0 and count >= items) or (minutes > 0 and now - oldest_at >= minutes * 60)
+        ]
+        if not due_users:
+            return {}
+
+        digests = {}
+        for uid in due_users:
+            async with db.execute(
+                "SELECT id, user_id, text, source, reason, link FROM notification_queue WHERE user_id=? ORDER BY id",
+                (uid,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            if rows:
+                digests[uid] = rows
+                await _delete_notifications(db, rows)
+        await db.commit()
+    return digests
+
+@db_call
+async def get_queue_stats():
+    """
+    Get queue depth and age in seconds of the oldest queued notification
+    """
+    async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
+        async with db.execute("SELECT COUNT(*), MIN(created_at) FROM notification_queue") as cursor:
+            count, oldest = await cursor.fetchone()
+    return count, (time.time() - oldest) if oldest else 0.0
+
 # --- BASIC PRACTICES ---
 
 # --- Adding ---
+@db_call
 async def add_user(uid):
     """
     Add a new user if not exists
@@ -108,6 +188,20 @@ async def add_user(uid):
         await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
         await db.commit()
 
+@db_call
+async def set_digest_mode(uid, minutes, items):
+    """
+    Set digest mode for a user (minutes=0 and items=0 disables it)
+    """
+    async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
+        await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
+        await db.execute(
+            "UPDATE users SET digest_minutes=?, digest_items=? WHERE user_id=?",
+            (minutes, items, uid)
+        )
+        await db.commit()
+
+@db_call
 async def add_source(username):
     """
     Add a new source if not exists and return its ID
@@ -118,6 +212,7 @@ async def add_source(username):
         async with db.execute("SELECT id FROM sources WHERE username = ?", (username,)) as cursor:
             return (await cursor.fetchone())[0]
 
+@db_call
 async def subscribe_user(uid, sid):
     """
     Subscribe a user to a source
@@ -126,6 +221,7 @@ async def subscribe_user(uid, sid):
         await db.execute("INSERT OR IGNORE INTO subscriptions (user_id, source_id) VALUES (?, ?)", (uid, sid))
         await db.commit()
 
+@db_call
 async def add_filter(uid, ft, val):
     """
     Add a filter for a user
@@ -137,6 +233,7 @@ async def add_filter(uid, ft, val):
             await db.commit()
 
 # --- Removing ---
+@db_call
 async def remove_subscription(user_id, channel_name):
     """
     Remove a subscription for a user
@@ -150,6 +247,7 @@ async def remove_subscription(user_id, channel_name):
         await db.commit()
         return True
 
+@db_call
 async def remove_filter(user_id, f_type, value):
     """
     Remove a filter for a user
@@ -158,6 +256,7 @@ async def remove_filter(user_id, f_type, value):
         await db.execute("DELETE FROM filters WHERE user_id=? AND filter_type=? AND value=?", (user_id, f_type, value))
         await db.commit()
 
+@db_call
 async def clear_all_data(user_id):
     """
     Clear all stored data for a user
@@ -168,6 +267,7 @@ async def clear_all_data(user_id):
         await db.commit()
 
 # --- Fetching ---
+@db_call
 async def get_users_for_source(username):
     """
     Get all user IDs subscribed to a specific source
@@ -176,6 +276,7 @@ async def get_users_for_source(username):
         res = await db.execute_fetchall("SELECT s.user_id FROM subscriptions s JOIN sources src ON s.source_id=src.id WHERE src.username=?", (username,))
         return [r[0] for r in res]
 
+@db_call
 async def get_user_filters(uid):
     """
     Get all filters for a user
@@ -183,6 +284,39 @@ async def get_user_filters(uid):
     async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
         return await db.execute_fetchall("SELECT filter_type, value FROM filters WHERE user_id=?", (uid,))
 
+@db_call
+async def get_filters_for_source(username):
+    """
+    Get filters of all subscribers of a source in one query: {user_id: [(filter_type, value)]}
+    """
+    async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
+        rows = await db.execute_fetchall(
+            """
+            SELECT s.user_id, f.filter_type, f.value FROM subscriptions s 
+            JOIN sources src ON s.source_id=src.id 
+            LEFT JOIN filters f ON f.user_id=s.user_id 
+            WHERE src.username=?
+            """, (username,)
+        )
+    result = {}
+    for uid, f_type, value in rows:
+        filters = result.setdefault(uid, [])
+        # subscribers without filters come with NULLs
+        if f_type is not None:
+            filters.append((f_type, value))
+    return result
+
+@db_call
+async def get_digest_mode(uid):
+    """
+    Get digest settings (minutes, items) for a user
+    """
+    async with aiosqlite.connect(DB_NAME, timeout=TIMEOUT) as db:
+        async with db.execute("SELECT digest_minutes, digest_items FROM users WHERE user_id=?", (uid,)) as cursor:
+            row = await cursor.fetchone()
+            return (row[0] or 0, row[1] or 0) if row else (0, 0)
+
+@db_call
 async def get_user_subscriptions_names(uid):
     """
     Get all source names subscribed to by a user
@@ -191,6 +325,7 @@ async def get_user_subscriptions_names(uid):
         res = await db.execute_fetchall("SELECT src.username FROM subscriptions s JOIN sources src ON s.source_id=src.id WHERE s.user_id=?", (uid,))
         return [r[0] for r in res]
     
+@db_call
 async def get_all_sources():
     """
     Get all source usernames
@@ -1,73 +1,427 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-from sentence_transformers import SentenceTransformer, util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
 import config
-import pymorphy3
+import metrics
+import profiler
+import logging
+import gc
+import os
+import time
 import re
 
+log = logging.getLogger(__name__)
+
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002702-\U000027B0"
+    "\U000024C2-\U0001F251"
+    "\U0001f926-\U0001f937"
+    "\U00010000-\U0010ffff"
+    "\u2640-\u2642"
+    "\u2600-\u2B55"
+    "\u200d"
+    "\u23cf"
+    "\u23e9"
+    "\u231a"
+    "\ufe0f"  # dingbats
+    "\u3030"
+    "]+"
+)
+WORD_PATTERN = re.compile(r'\w+')
+# lone surrogates (broken emojis) can not be encoded to utf-8
+SURROGATE_PATTERN = re.compile('[\ud800-\udfff]')
+
+# same template as the zero-shot-classification pipeline
+HYPOTHESIS_TEMPLATE = "This example is {}."
+# cached word -> lemma pairs, the cache is reset when it grows over this size
+LEMMA_CACHE_SIZE = 200000
+# cached topic embeddings and hypothesis token ids
+TOPIC_CACHE_SIZE = 10000
+# seconds to wait for forked inference workers to load and warm up
+WORKER_START_TIMEOUT = 300
+
 def remove_emojis_regex(text):
     """
     Removes all the emojis
     """
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        "\U00002702-\U000027B0"
-        "\U000024C2-\U0001F251"
-        "\U0001f926-\U0001f937"
-        "\U00010000-\U0010ffff"
-        "\u2640-\u2642"
-        "\u2600-\u2B55"
-        "\u200d"
-        "\u23cf"
-        "\u23e9"
-        "\u231a"
-        "\ufe0f"  # dingbats
-        "\u3030"
-        "]+"
-    )
-    return emoji_pattern.sub(r'', text)
+    return EMOJI_PATTERN.sub('', text)
+
+def clean_text(text):
+    """
+    Guard against Unicode issues by removing lone surrogates
+    """
+    if not text: return ""
+    return SURROGATE_PATTERN.sub('', text)
+
+class PreparedText:
+    """
+    Message normalized once and shared by all users and filters
+        - text: cleaned message text
+        - model_text: text without emojis for the models
+        - lemmas: normal forms of words joined with spaces (keyword search)
+        - nli_chunks: token ids of the NLI tokenizer, NLI_CHUNK_TOKENS per chunk
+        - emb_chunks: token ids of the embedding tokenizer, max sequence length per chunk
+    Parts not required by the evaluation plan stay None
+    """
+    __slots__ = ("text", "model_text", "lemmas", "nli_chunks", "emb_chunks")
+
+    def __init__(self, text):
+        self.text = text
+        self.model_text = remove_emojis_regex(text).strip()
+        self.lemmas = None
+        self.nli_chunks = None
+        self.emb_chunks = None
+
+def is_long_topic(topic):
+    """
+    Long topics (> 4 words) are checked by vector similarity, short ones by NLI
+    """
+    return len(topic.split()) > 4
+
+class EvaluationPlan:
+    """
+    Stages a message needs, computed from the union of the filters of its subscribers
+        - filters: {user_id: filters} of users that can still match
+        - lemmas: block or keyword filters present
+        - nli: short topics present
+        - embeddings: long topics present
+        - lexical_values: distinct block and keyword values of all users
+        - value_lemmas: {value: lemmatized value}, filled once per plan by the engine
+    """
+    __slots__ = ("filters", "lemmas", "nli", "embeddings", "lexical_values", "value_lemmas")
+
+    def __init__(self, filters_by_user):
+        # users without keywords and topics can never get a match
+        self.filters = {
+            uid: filters for uid, filters in filters_by_user.items()
+            if any(f_type in ('keyword', 'topic') for f_type, _ in filters)
+        }
+        types = {f_type for filters in self.filters.values() for f_type, _ in filters}
+        topics = {val for filters in self.filters.values() for f_type, val in filters if f_type == 'topic'}
+
+        self.lemmas = 'block' in types or 'keyword' in types
+        self.nli = any(not is_long_topic(t) for t in topics)
+        self.embeddings = any(is_long_topic(t) for t in topics)
+
+        self.lexical_values = {
+            val for filters in self.filters.values() for f_type, val in filters
+            if f_type in ('block', 'keyword')
+        }
+        self.value_lemmas = {}
+
+def local_model_dir(model_name):
+    """
+    Local directory pinned for the model: MODEL_DIR/<org>--<name>
+    """
+    return os.path.join(config.MODEL_DIR, model_name.replace("/", "--"))
+
+# --- INFERENCE WORKER PROCESSES ---
+# workers are forked from the process that already loaded the models,
+# so all of them share the same weight pages (copy-on-write) instead of loading their own copy
+
+_worker_engine = None
+
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+    _worker_engine._warm_up()
+
+def _worker_ping():
+    return os.getpid()
+
+def _worker_call(method, *args):
+    return getattr(_worker_engine, method)(*args)
+
+def _kill_pool(pool):
+    """
+    Shut down a process pool without waiting for its workers, killing hung ones
+    """
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.kill()
 
 class FilterEngine:
     def __init__(self):
+        # models are loaded in the background by start_loading()
+        # so that the telegram client can connect and buffer events meanwhile
+        self.morph = None
+        self.dedup_model = None
+        self.classifier = None
+        self.cos_sim = None
+        self._loading = None
+
+        self._lemma_cache = {}
+        self._hypothesis_cache = {}
+        self._topic_emb_cache = {}
+
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        # process pool for model inference, see INFERENCE_WORKERS
+        self.workers = None
+
+    # --- MODEL LOADING ---
+    def _load_models(self):
+        """
+        Load all models from the local cache (download and pin them on the first run)
+        """
+        start = time.perf_counter()
+        log.info("Loading models.")
+        # heavy imports are deferred so that importing the module is cheap
+        import pymorphy3
+        from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+        from sentence_transformers import SentenceTransformer, util
+
         self.morph = pymorphy3.MorphAnalyzer()
-        print("Loading models.")
+        self.cos_sim = util.cos_sim
+
         # model for deduplication (check whether the news is similar to previous ones)
-        self.dedup_model = SentenceTransformer(config.ML_MODEL_NAME)
+        dedup_dir = local_model_dir(config.ML_MODEL_NAME)
+        if os.path.isdir(dedup_dir):
+            self.dedup_model = SentenceTransformer(dedup_dir, local_files_only=True)
+        else:
+            log.info("Downloading %s to %s", config.ML_MODEL_NAME, dedup_dir)
+            self.dedup_model = SentenceTransformer(config.ML_MODEL_NAME)
+            self.dedup_model.save(dedup_dir + ".tmp")
+            os.replace(dedup_dir + ".tmp", dedup_dir)
 
         # model for topic classification (zero-shot)
-        tokenizer = AutoTokenizer.from_pretrained(config.ML_MODEL_NAME_TOPICS)
-        model = AutoModelForSequenceClassification.from_pretrained(config.ML_MODEL_NAME_TOPICS)
+        topics_dir = local_model_dir(config.ML_MODEL_NAME_TOPICS)
+        if os.path.isdir(topics_dir):
+            tokenizer = AutoTokenizer.from_pretrained(topics_dir, local_files_only=True)
+            model = AutoModelForSequenceClassification.from_pretrained(
+                topics_dir, local_files_only=True, use_safetensors=True
+            )
+        else:
+            log.info("Downloading %s to %s", config.ML_MODEL_NAME_TOPICS, topics_dir)
+            tokenizer = AutoTokenizer.from_pretrained(config.ML_MODEL_NAME_TOPICS)
+            model = AutoModelForSequenceClassification.from_pretrained(config.ML_MODEL_NAME_TOPICS)
+            tokenizer.save_pretrained(topics_dir + ".tmp")
+            model.save_pretrained(topics_dir + ".tmp", safe_serialization=True)
+            os.replace(topics_dir + ".tmp", topics_dir)
+        model.eval()
         self.classifier = pipeline(
             "zero-shot-classification", 
             model=model, 
             tokenizer=tokenizer
         )
 
-        self.executor = ThreadPoolExecutor(max_workers=2)
-        print("Models uploaded.")
+        # chunk sizes in tokens without special tokens
+        self.nli_budget = config.NLI_CHUNK_TOKENS
+        self.emb_budget = self.dedup_model.max_seq_length - 2
+        entailment_id = self.classifier.entailment_id
+        self.nli_label_ids = [-1 if entailment_id == 0 else 0, entailment_id]
+        log.info("Models uploaded in %.1f s.", time.perf_counter() - start)
+
+    def _warm_up(self):
+        """
+        Run every model once so that the first real message 
+        does not pay for lazy initialization and memory allocation
+        """
+        start = time.perf_counter()
+        prepared = self._tokenize_sync(self._prepare_sync("Warm up. Прогрев моделей"))
+        self._check_topic_zeroshot(prepared, "news")
+        self._check_duplicate_sync(prepared, ["warm up"])
+        log.info("Models warmed up in %.1f s.", time.perf_counter() - start)
+
+    async def _start_workers(self, count):
+        """
+        Fork inference workers sharing the loaded weights.
+        Must run before any inference in this process: 
+        thread pools of torch are not fork-safe once used, so workers are forked only once.
+        Returns False if they did not start (models then run in threads)
+        """
+        global _worker_engine
+        _worker_engine = self
+
+        # keep the garbage collector from touching (and so copying) the inherited objects
+        gc.collect()
+        gc.freeze()
+
+        pool = ProcessPoolExecutor(
+            max_workers=count,
+            mp_context=mp.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(config.INFERENCE_THREADS,)
+        )
+        # all workers are forked on the first submit, wait until they are warmed up
+        loop = asyncio.get_running_loop()
+        pings = asyncio.gather(*(loop.run_in_executor(pool, _worker_ping) for _ in range(count)))
+        try:
+            await asyncio.wait_for(pings, WORKER_START_TIMEOUT)
+        except Exception as e:
+            _kill_pool(pool)
+            log.error("Inference workers did not start (%r), running models in threads.", e)
+            return False
+        self.workers = pool
+        log.info("Started %d inference workers.", count)
+        return True
+
+    def _stop_workers(self, broken):
+        """
+        Drop a pool broken by a dead worker (OOM kill, crash in torch) and run models in threads from now on.
+        The pool is not forked again: this process may already hold locks or used torch thread pools
+        """
+        if self.workers is not broken:
+            # another call already dropped it
+            return
+        self.workers = None
+        _kill_pool(broken)
+        log.error("Inference workers stopped, running models in threads.")
+
+    async def _load(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._load_models)
+
+        if config.INFERENCE_WORKERS > 0:
+            if "fork" not in mp.get_all_start_methods():
+                log.warning("Inference workers need fork, running models in threads.")
+            elif await self._start_workers(config.INFERENCE_WORKERS):
+                return
+        await loop.run_in_executor(self.executor, self._warm_up)
+
+    def start_loading(self):
+        """
+        Start loading models in the background (only once).
+        Returns an awaitable that completes when models are ready
+        """
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+        return self._loading
+
+    async def wait_ready(self):
+        await self.start_loading()
 
     # --- LEMMATIZATION HELPER ---
+    def _lemmatize_words(self, words):
+        """
+        Normal forms of words, parsed once per distinct word
+        """
+        cache = self._lemma_cache
+        if len(cache) > LEMMA_CACHE_SIZE:
+            cache.clear()
+
+        lemmas = []
+        for word in words:
+            lemma = cache.get(word)
+            if lemma is None:
+                lemma = cache[word] = self.morph.parse(word)[0].normal_form
+            lemmas.append(lemma)
+        return lemmas
+
     def _lemmatize_text(self, text):
         """
         Processess text to make it a sequence of normal form of words
         """
         if not text: return ""
         
-        # remove commas
-        words = re.findall(r'\w+', text.lower())
-        
-        # lemmatize
-        lemmas = [self.morph.parse(word)[0].normal_form for word in words]
+        with metrics.LEMMATIZE_SECONDS.time():
+            # remove commas
+            words = WORD_PATTERN.findall(text.lower())
+            
+            # lemmatize
+            lemmas = self._lemmatize_words(words)
         
         return " ".join(lemmas)
 
+    # --- NORMALIZATION ---
+    @staticmethod
+    def _chunk_ids(tokenizer, text, budget):
+        """
+        Tokenize text once and split token ids into chunks of at most budget tokens
+        """
+        ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+        return [ids[i:i + budget] for i in range(0, len(ids), budget)] or [[]]
+
+    def _prepare_sync(self, text, lemmas=True):
+        """
+        Normalization pass: cleaned text and, if required, lemmas
+        """
+        prepared = PreparedText(text)
+        if lemmas:
+            prepared.lemmas = self._lemmatize_text(text)
+        return prepared
+
+    def _prepare_for_plan_sync(self, text, plan):
+        """
+        Normalization pass for a plan: the message and, once for all users,
+        every distinct block/keyword value
+        """
+        prepared = self._prepare_sync(text, lemmas=plan.lemmas)
+        if plan.lemmas:
+            plan.value_lemmas = {val: self._lemmatize_text(val) for val in plan.lexical_values}
+        return prepared
+
+    def _tokenize_sync(self, prepared, nli=True, emb=True):
+        """
+        Tokenize the message once per model (only the parts still missing)
+        """
+        with metrics.TOKENIZE_SECONDS.time():
+            if nli and prepared.nli_chunks is None:
+                prepared.nli_chunks = self._chunk_ids(self.classifier.tokenizer, prepared.model_text, self.nli_budget)
+            if emb and prepared.emb_chunks is None:
+                prepared.emb_chunks = self._chunk_ids(self.dedup_model.tokenizer, prepared.model_text, self.emb_budget)
+        return prepared
+
+    # --- MODEL HELPERS ---
+    def _hypothesis_ids(self, label):
+        ids = self._hypothesis_cache.get(label)
+        if ids is None:
+            if len(self._hypothesis_cache) > TOPIC_CACHE_SIZE:
+                self._hypothesis_cache.clear()
+            ids = self._hypothesis_cache[label] = self.classifier.tokenizer(
+                HYPOTHESIS_TEMPLATE.format(label), add_special_tokens=False
+            )["input_ids"]
+        return ids
+
+    def _nli_score(self, prepared, topic):
+        """
+        Entailment probability of the topic, max-pooled over chunks and comma separated labels
+        (same scoring as the zero-shot pipeline with multi_label=True)
+        """
+        import torch
+        tokenizer = self.classifier.tokenizer
+        model = self.classifier.model
+
+        labels = [label.strip() for label in topic.split(",") if label.strip()] or [topic]
+        pairs = [
+            tokenizer.prepare_for_model(chunk, self._hypothesis_ids(label))
+            for chunk in prepared.nli_chunks
+            for label in labels
+        ]
+        batch = tokenizer.pad(pairs, return_tensors="pt").to(model.device)
+        with torch.inference_mode():
+            logits = model(**batch).logits
+        scores = logits[:, self.nli_label_ids].softmax(dim=-1)[:, 1]
+        return float(scores.max())
+
+    def _embed_chunks(self, chunks):
+        """
+        Sentence embeddings of already tokenized chunks
+        """
+        import torch
+        tokenizer = self.dedup_model.tokenizer
+        features = tokenizer.pad([tokenizer.prepare_for_model(ids) for ids in chunks], return_tensors="pt")
+        features = {k: v.to(self.dedup_model.device) for k, v in features.items()}
+        with torch.inference_mode():
+            return self.dedup_model(features)["sentence_embedding"]
+
+    def _topic_embedding(self, topic):
+        emb = self._topic_emb_cache.get(topic)
+        if emb is None:
+            if len(self._topic_emb_cache) > TOPIC_CACHE_SIZE:
+                self._topic_emb_cache.clear()
+            emb = self._topic_emb_cache[topic] = self.dedup_model.encode(topic, convert_to_tensor=True)
+        return emb
+
     # --- SYNC INTERNAL METHODS ---
-    def _check_topic_zeroshot(self, text, topic):
+    def _check_topic_zeroshot(self, prepared, topic):
         """
         Checks whether the text matches the topic
         Uses either 
@@ -75,90 +429,163 @@ class FilterEngine:
             - Vector Similarity
         depending on the length of the topic
         """
-        text = remove_emojis_regex(text).strip()
-        words = topic.split()
-
         # CASE 1: user entered short topic (<= 4 words)
-        if len(words) <= 4:            
-            result = self.classifier(
-                text, 
-                candidate_labels=topic, 
-                multi_label=True
-            )
-            score = result['scores'][0]
-            print(f"  Zero-Shot (Tag): '{topic}' -> {score:.4f}")
+        if not is_long_topic(topic):
+            score = self._nli_score(prepared, topic)
+            log.debug("  Zero-Shot (Tag): '%s' -> %.4f", topic, score)
             return score > 0.40
 
         # CASE 2: user entered long topic (> 4 words)
         else:
-            embeddings = self.dedup_model.encode([text, topic], convert_to_tensor=True)
-            cosine_score = util.cos_sim(embeddings[0], embeddings[1])
-            score = cosine_score.item()
-            print(f"  Vector Sim (Long): '{topic[:25]}...' -> {score:.4f}")
+            chunk_embs = self._embed_chunks(prepared.emb_chunks)
+            topic_emb = self._topic_embedding(topic)
+            score = float(self.cos_sim(chunk_embs, topic_emb).max())
+            log.debug("  Vector Sim (Long): '%s...' -> %.4f", topic[:25], score)
             return score > 0.30
     
-    def _check_duplicate_sync(self, new_text, history_texts):
+    def _check_duplicate_sync(self, prepared, history_texts):
         """
-        Check whether new_text is a duplicate of any text in history_texts
-        using semantic similarity.
+        Check whether the prepared text is a duplicate of any text in history_texts
+        using semantic similarity (best match of any chunk).
         """
         if not history_texts:
             return False
             
-        new_emb = self.dedup_model.encode(new_text, convert_to_tensor=True)
-        history_embs = self.dedup_model.encode(history_texts, convert_to_tensor=True)
+        new_embs = self._embed_chunks(prepared.emb_chunks)
+        # history is stored raw, normalize it like the new message
+        history_embs = self.dedup_model.encode(
+            [remove_emojis_regex(h).strip() for h in history_texts], convert_to_tensor=True
+        )
         
-        cosine_scores = util.cos_sim(new_emb, history_embs)[0]
-        best_score = float(cosine_scores.max())
+        best_score = float(self.cos_sim(new_embs, history_embs).max())
         
-        print(f" Dedup Score: {best_score:.4f}")
+        log.debug(" Dedup Score: %.4f", best_score)
         return best_score > 0.85
 
     # --- ASYNC WRAPPERS ---
-    async def check_semantic(self, text, topic):
+    async def _run(self, method, *args):
+        """
+        Run a sync model method in inference workers if enabled, otherwise in a thread
+        """
+        loop = asyncio.get_running_loop()
+        workers = self.workers
+        if workers is not None:
+            try:
+                return await loop.run_in_executor(workers, _worker_call, method, *args)
+            except BrokenProcessPool:
+                log.error("Inference worker died during %s.", method)
+                self._stop_workers(workers)
+        return await loop.run_in_executor(self.executor, getattr(self, method), *args)
+
+    async def prepare(self, text, lemmas=True):
+        """
+        Normalize the message once before checking it for every user
+        """
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(self.executor, self._check_topic_zeroshot, text, topic)
+        return await loop.run_in_executor(self.executor, self._prepare_sync, text, lemmas)
 
-    async def is_duplicate(self, new_text, history_texts):
+    async def prepare_for_plan(self, text, plan):
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(self.executor, self._check_duplicate_sync, new_text, history_texts)
+        return await loop.run_in_executor(self.executor, self._prepare_for_plan_sync, text, plan)
+
+    async def tokenize(self, prepared, nli=True, emb=True):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._tokenize_sync, prepared, nli, emb)
+
+    # model timings are observed here and not in the sync methods, 
+    # histograms of forked inference workers would never be exported
+    async def check_semantic(self, prepared, topic):
+        seconds = metrics.EMBEDDING_SECONDS if is_long_topic(topic) else metrics.NLI_SECONDS
+        with seconds.time():
+            return await self._run("_check_topic_zeroshot", prepared, topic)
+
+    async def is_duplicate(self, prepared, history_texts):
+        if not history_texts:
+            return False
+        if isinstance(prepared, str):
+            prepared = await self.prepare(prepared, lemmas=False)
+        with metrics.DEDUP_SECONDS.time(), profiler.stage("dedup"):
+            await self.tokenize(prepared, nli=False, emb=True)
+            with metrics.EMBEDDING_SECONDS.time():
+                return await self._run("_check_duplicate_sync", prepared, history_texts)
 
     # --- HELPER METHODS ---
-    def check_keyword(self, text, keyword):
+    def _check_lexical(self, prepared, filters, value_lemmas):
         """
-        Keyword search with lemmatization
+        Block and keyword filters of one user, values are already lemmatized by the plan.
+        Returns (True, reason) on keyword match, (False, None) if the message is blocked 
+        or can not match, (None, None) if only topic filters can decide
         """
-        clean_text = self._lemmatize_text(text)
-        clean_keyword = self._lemmatize_text(keyword)
-
-        return clean_keyword in clean_text
-    
-    # --- MAIN METHOD ---
-    async def process_message(self, text, filters):
-        if not text: return False, None
-        
-        # trim text so that models can handle it
-        analysis_text = text[:1000] 
-        lemmatized_text = self._lemmatize_text(text)
+        lemmatized_text = prepared.lemmas
 
         # block filter
         block_filters = [val for f_type, val in filters if f_type == 'block']
         for block_word in block_filters:
-            if self.check_keyword(text, block_word):
+            if value_lemmas[block_word] in lemmatized_text:
                 return False, None
 
-        # --- CHECK FILTERS ---
         # keywords
         keyword_filters = [val for f_type, val in filters if f_type == 'keyword']
         for val in keyword_filters:
-            clean_val = self._lemmatize_text(val)
-            if clean_val in lemmatized_text:
+            if value_lemmas[val] in lemmatized_text:
                 return True, f"Keyword: {val}"
+
+        if any(f_type == 'topic' for f_type, _ in filters):
+            return None, None
+        return False, None
+    
+    # --- MAIN METHOD ---
+    async def process_source_message(self, text, filters_by_user):
+        """
+        Check one message against the filters of all subscribers of its source.
+        Stages nobody needs (lemmas, NLI, embeddings) are skipped.
+        Returns the prepared message and [(user_id, reason)] of matched users
+        """
+        if not text: return None, []
+
+        plan = EvaluationPlan(filters_by_user)
+        if not plan.filters:
+            metrics.STAGES.inc(stage="all", result="skipped")
+            return None, []
+
+        with profiler.stage("lemmas"):
+            prepared = await self.prepare_for_plan(text, plan)
+        metrics.STAGES.inc(stage="lemmas", result="run" if plan.lemmas else "skipped")
+
+        # --- LEXICAL STAGE ---
+        matches = []
+        undecided = {}
+        for uid, filters in plan.filters.items():
+            if plan.lemmas:
+                matched, reason = self._check_lexical(prepared, filters, plan.value_lemmas)
+            else:
+                matched, reason = None, None
+            if matched:
+                matches.append((uid, reason))
+            elif matched is None:
+                undecided[uid] = filters
+
+        # --- MODEL STAGE ---
+        # only users left without a decision and only the models their topics need
+        plan = EvaluationPlan(undecided)
+        metrics.STAGES.inc(stage="nli", result="run" if plan.nli else "skipped")
+        metrics.STAGES.inc(stage="embeddings", result="run" if plan.embeddings else "skipped")
+        if not plan.filters:
+            return prepared, matches
+
+        with profiler.stage("tokenize"):
+            await self.tokenize(prepared, nli=plan.nli, emb=plan.embeddings)
+
+        # the same topic is scored once per message for all users
+        topic_results = {}
+        for uid, filters in plan.filters.items():
+            topic_filters = [val for f_type, val in filters if f_type == 'topic']
+            for val in topic_filters:
+                if val not in topic_results:
+                    with profiler.stage("nli" if not is_long_topic(val) else "embeddings"):
+                        topic_results[val] = await self.check_semantic(prepared, val)
+                if topic_results[val]:
+                    matches.append((uid, f"Topic: {val}"))
+                    break
         
-        # topics
-        topic_filters = [val for f_type, val in filters if f_type == 'topic']
-        for val in topic_filters:
-            if await self.check_semantic(analysis_text, val):
-                return True, f"Topic: {val}"
-        
-        return False, None
\ No newline at end of file
+        return prepared, matches
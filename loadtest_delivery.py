@@ -0,0 +1,283 @@
+"""
+Load test of notification delivery against a local fake Bot API server
+
+The fake server answers sendMessage like Telegram does: it applies per-chat
+and global rate limits, replies 429 with retry_after when they are exceeded
+and adds random latency. The load generator fills notification_queue in a
+temporary database and runs bot.notification_worker until everything is delivered.
+
+Example:
+    py loadtest_delivery.py --rows 2000 --users 200 --digest-share 0.2 --out delivery.json
+
+--send-interval sets the worker's pause after each message (SEND_INTERVAL, 0.5 s
+in production, which alone caps delivery at 2 msg/s); it defaults to 0 here.
+
+Only the server (to point a separately started bot.py at it with BOT_API_URL):
+    py loadtest_delivery.py --serve-only --port 8081
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import time
+
+from aiohttp import web
+
+from bench_utils import percentiles, git_commit
+
+# every queued text starts with this marker so the server can measure queue latency
+MARKER_PATTERN = re.compile(r"lt:(\d+\.\d+)")
+
+# getMe answer, the id matches the dummy BOT_TOKEN
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Load test bot", "username": "loadtest_bot"}
+
+# --- FAKE BOT API SERVER ---
+
+class RateLimiter:
+    """
+    Sliding one-second window: at most `limit` messages per second
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.sent = []
+
+    def wait_time(self, now):
+        """
+        Seconds to wait before the next message is allowed (0 if allowed now)
+        """
+        while self.sent and now - self.sent[0] >= 1:
+            self.sent.pop(0)
+        if len(self.sent) >= self.limit:
+            return 1 - (now - self.sent[0])
+        return 0
+
+    def add(self, now):
+        self.sent.append(now)
+
+class FakeBotAPI:
+    def __init__(self, chat_limit=1, global_limit=30, latency=(0.02, 0.12), seed=0):
+        self.chat_limit = chat_limit
+        self.global_limit = RateLimiter(global_limit)
+        self.chats = {}
+        self.latency = latency
+        self.rng = random.Random(seed)
+
+        self.delivered = 0
+        self.rejected = 0
+        self.queue_latencies = []
+        self.message_id = 0
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        data = await request.post()
+        await asyncio.sleep(self.rng.uniform(*self.latency))
+
+        method = method.lower()
+        if method == "getme":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        if method == "getupdates":
+            return web.json_response({"ok": True, "result": []})
+        if method != "sendmessage":
+            # deleteWebhook and other boolean methods
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(data["chat_id"])
+        now = time.monotonic()
+        chat_limiter = self.chats.setdefault(chat_id, RateLimiter(self.chat_limit))
+        wait = max(chat_limiter.wait_time(now), self.global_limit.wait_time(now))
+        if wait:
+            self.rejected += 1
+            retry_after = max(1, math.ceil(wait))
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+
+        chat_limiter.add(now)
+        self.global_limit.add(now)
+
+        received = time.time()
+        text = data.get("text", "")
+        for created_at in MARKER_PATTERN.findall(text):
+            self.queue_latencies.append(received - float(created_at))
+
+        self.delivered += 1
+        self.message_id += 1
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "message_id": self.message_id,
+                "date": int(received),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            },
+        })
+
+async def start_server(api, port):
+    runner = web.AppRunner(api.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+# --- LOAD GENERATOR ---
+
+async def fill_queue(db, rng, rows, users, digest_share, digest_minutes, digest_items):
+    """
+    Insert `rows` notifications for `users` chats in one transaction
+    """
+    import aiosqlite
+
+    digest_users = set(rng.sample(range(1, users + 1), int(users * digest_share)))
+    for uid in range(1, users + 1):
+        await db.add_user(uid)
+    for uid in digest_users:
+        await db.set_digest_mode(uid, digest_minutes, digest_items)
+
+    now = time.time()
+    batch = []
+    for i in range(rows):
+        uid = rng.randint(1, users)
+        batch.append((
+            uid,
+            f"lt:{now:.6f} load test news {i} " + "text " * rng.randint(5, 60),
+            f"source_{rng.randint(1, 20)}",
+            f"Keyword: word{rng.randint(1, 5)}",
+            f"https://t.me/source/{i}",
+            now,
+        ))
+    async with aiosqlite.connect(db.DB_NAME, timeout=db.TIMEOUT) as conn:
+        await conn.executemany(
+            "INSERT INTO notification_queue (user_id, text, source, reason, link, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            batch
+        )
+        await conn.commit()
+    return len(digest_users)
+
+async def run(args):
+    rng = random.Random(args.seed)
+    api = FakeBotAPI(args.chat_limit, args.global_limit, (args.min_latency, args.max_latency), args.seed)
+    runner = await start_server(api, args.port)
+
+    # the bot talks to the fake server with a dummy token
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["BOT_TOKEN"] = "123456:LOADTEST"
+    # the fake server enforces the rate limits, the worker's own pacing is under test
+    os.environ["SEND_INTERVAL"] = str(args.send_interval)
+    os.environ.setdefault("API_ID", "0")
+    os.environ.setdefault("API_HASH", "loadtest")
+
+    import database as db
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(prefix="filternews_delivery_"), "delivery.db")
+    await db.init_db()
+
+    import bot
+    import metrics
+
+    digest_users = await fill_queue(db, rng, args.rows, args.users, args.digest_share, args.digest_minutes, args.digest_items)
+    print(f"Queued {args.rows} notifications for {args.users} users ({digest_users} in digest mode).")
+
+    start = time.perf_counter()
+    worker = asyncio.create_task(bot.notification_worker())
+    timed_out = False
+    while len(api.queue_latencies) < args.rows:
+        await asyncio.sleep(0.5)
+        if time.perf_counter() - start > args.timeout:
+            timed_out = True
+            break
+    elapsed = time.perf_counter() - start
+    worker.cancel()
+    await bot.bot.session.close()
+    await runner.cleanup()
+
+    depth, _ = await db.get_queue_stats()
+    flood_wait = metrics.FLOOD_WAIT_SECONDS.total()
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "scenario": {
+            "rows": args.rows,
+            "users": args.users,
+            "digest_users": digest_users,
+            "digest_minutes": args.digest_minutes,
+            "digest_items": args.digest_items,
+            "chat_limit": args.chat_limit,
+            "global_limit": args.global_limit,
+            "latency_s": [args.min_latency, args.max_latency],
+            "send_interval_s": args.send_interval,
+            "seed": args.seed,
+        },
+        "timed_out": timed_out,
+        "elapsed_s": elapsed,
+        "messages_sent": api.delivered,
+        "notifications_delivered": len(api.queue_latencies),
+        "notifications_left_in_queue": depth,
+        "messages_per_s": api.delivered / elapsed if elapsed else None,
+        "notifications_per_s": len(api.queue_latencies) / elapsed if elapsed else None,
+        "retries_429": api.rejected,
+        "flood_wait_s": flood_wait,
+        "queue_latency": percentiles(api.queue_latencies),
+    }
+
+def print_report(result):
+    print(f"\nCommit: {result['commit']}  Scenario: {result['scenario']}")
+    if result["timed_out"]:
+        print("TIMED OUT, numbers cover the delivered part only")
+    print(f"Sent {result['messages_sent']} messages with {result['notifications_delivered']} notifications "
+          f"in {result['elapsed_s']:.1f} s, {result['notifications_left_in_queue']} left in queue")
+    print(f"Throughput: {result['messages_per_s']:.2f} msg/s, {result['notifications_per_s']:.2f} notifications/s")
+    print(f"429 retries: {result['retries_429']}, flood wait: {result['flood_wait_s']:.0f} s")
+    latency = result["queue_latency"]
+    if latency["count"]:
+        print(f"Queue latency: p50 {latency['p50_ms'] / 1000:.1f} s, "
+              f"p95 {latency['p95_ms'] / 1000:.1f} s, p99 {latency['p99_ms'] / 1000:.1f} s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test notification delivery against a fake Bot API server")
+    parser.add_argument("--rows", type=int, default=2000, help="notifications to queue")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--digest-share", type=float, default=0.0, help="share of users in digest mode")
+    parser.add_argument("--digest-minutes", type=int, default=1)
+    parser.add_argument("--digest-items", type=int, default=20)
+    parser.add_argument("--chat-limit", type=int, default=1, help="messages per second per chat")
+    parser.add_argument("--global-limit", type=int, default=30, help="messages per second overall")
+    parser.add_argument("--min-latency", type=float, default=0.02)
+    parser.add_argument("--max-latency", type=float, default=0.12)
+    parser.add_argument("--send-interval", type=float, default=0.0,
+                        help="SEND_INTERVAL of the worker, pause after each sent message")
+    parser.add_argument("--timeout", type=float, default=3600, help="stop after this many seconds")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--serve-only", action="store_true", help="only run the fake Bot API server")
+    parser.add_argument("--out", help="save results to this JSON file")
+    return parser.parse_args()
+
+async def serve_forever(args):
+    api = FakeBotAPI(args.chat_limit, args.global_limit, (args.min_latency, args.max_latency), args.seed)
+    await start_server(api, args.port)
+    print(f"Fake Bot API on http://127.0.0.1:{args.port} (set BOT_API_URL to use it)")
+    while True:
+        await asyncio.sleep(10)
+        print(f"sent {api.delivered}, 429 {api.rejected}")
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.serve_only:
+        asyncio.run(serve_forever(args))
+    else:
+        result = asyncio.run(run(args))
+        print_report(result)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+            print(f"Saved to {args.out}")
@@ -3,8 +3,12 @@ from telethon import TelegramClient, functions, errors
 from telethon.tl.types import User, Channel, Chat
 import config
 import database as db
+import metrics
+import logging
 import time
 
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
+
 # manager session name
 SESSION_NAME = "manager_session"
 
@@ -12,6 +16,7 @@ async def main():
     print("Running background subscriptions manager")
     
     await db.init_db()
+    await metrics.start_exporter("manager", port_offset=2)
     
     client = TelegramClient(SESSION_NAME, config.API_ID, config.API_HASH)
     await client.start()
@@ -76,6 +81,7 @@ async def main():
                         
                     except errors.FloodWaitError as e:
                         print(f"\n   Faced limit, wait {e.seconds} seconds")
+                        metrics.FLOOD_WAIT_SECONDS.inc(e.seconds)
                         await asyncio.sleep(e.seconds + 2)
                     except ValueError:
                         print(" Channel entity not found (ValueError).")
@@ -0,0 +1,202 @@
+"""
+Lightweight metrics: counters, gauges and histograms
+exported in Prometheus text format over HTTP and/or to a file
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+import config
+
+log = logging.getLogger(__name__)
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_label_str(labels)} {value}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def total(self):
+        """
+        Sum over all label combinations
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][idx] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = _label_str(labels + (("le", bound),))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_str(labels)} {total}")
+                lines.append(f"{self.name}_count{_label_str(labels)} {cumulative}")
+        return lines
+
+class _Timer:
+    """
+    Context manager observing elapsed time into a histogram
+    """
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+
+def db_call(func):
+    """
+    Decorator for database coroutines: records call latency labeled by function name
+    """
+    op = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            DB_CALL_SECONDS.observe(time.perf_counter() - start, op=op)
+    return wrapper
+
+# --- METRICS ---
+
+# scanner
+EVENTS = Counter("filternews_events_total", "Incoming Telegram events by outcome")
+MATCHES = Counter("filternews_matches_total", "Filter matches by outcome (queued or duplicate)")
+HANDLER_SECONDS = Histogram("filternews_handler_seconds", "Time to handle one incoming message")
+DB_CALL_SECONDS = Histogram("filternews_db_call_seconds", "Database call latency")
+
+# filter engine
+LEMMATIZE_SECONDS = Histogram("filternews_lemmatize_seconds", "Lemmatization time per text")
+TOKENIZE_SECONDS = Histogram("filternews_tokenize_seconds", "Tokenization and chunking time per message")
+EMBEDDING_SECONDS = Histogram("filternews_embedding_seconds", "Sentence embedding time per call, including the wait for an inference worker")
+NLI_SECONDS = Histogram("filternews_nli_seconds", "Zero-shot NLI classification time per call, including the wait for an inference worker")
+STAGES = Counter("filternews_stage_runs_total", "Pipeline stages run or skipped by the per-source evaluation plan")
+DEDUP_SECONDS = Histogram("filternews_dedup_seconds", "Duplicate check time per message and user")
+
+# delivery
+QUEUE_DEPTH = Gauge("filternews_queue_depth", "Notifications waiting in the queue")
+QUEUE_AGE_SECONDS = Gauge("filternews_queue_oldest_age_seconds", "Age of the oldest queued notification")
+SEND_SECONDS = Histogram("filternews_send_seconds", "Bot API send_message latency")
+SENT = Counter("filternews_sent_total", "Sent messages by kind and outcome")
+FLOOD_WAIT_SECONDS = Counter("filternews_flood_wait_seconds_total", "Time spent waiting on Telegram flood limits")
+
+# --- EXPORT ---
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def _handle_http(reader, writer):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = render().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except Exception as e:
+        log.debug("Metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+async def _dump_loop(path, interval):
+    while True:
+        await asyncio.sleep(interval)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(render())
+        os.replace(tmp, path)
+
+async def start_exporter(name, port_offset=0):
+    """
+    Start the exporters enabled in config:
+        - HTTP endpoint on 127.0.0.1:(METRICS_PORT + port_offset)
+        - file dump to METRICS_DIR/<name>.prom every METRICS_INTERVAL seconds
+    """
+    if config.METRICS_PORT:
+        port = config.METRICS_PORT + port_offset
+        await asyncio.start_server(_handle_http, "127.0.0.1", port)
+        log.info("Metrics for %s on http://127.0.0.1:%d/metrics", name, port)
+    if config.METRICS_DIR:
+        os.makedirs(config.METRICS_DIR, exist_ok=True)
+        path = os.path.join(config.METRICS_DIR, f"{name}.prom")
+        asyncio.create_task(_dump_loop(path, config.METRICS_INTERVAL))
+        log.info("Metrics for %s dumped to %s", name, path)
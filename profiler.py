@@ -0,0 +1,203 @@
+"""
+Opt-in profiler of the scanner hot path
+    - stack sampler writing flamegraph-compatible folded stacks (flamegraph.pl, speedscope)
+    - per-message stage breakdown and a log of the slowest messages
+
+Enabled with PROFILE=1 or toggled at runtime with SIGUSR2.
+While disabled message() and stage() return a shared no-op context manager
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import config
+
+log = logging.getLogger(__name__)
+
+_enabled = False
+_current = contextvars.ContextVar("profiled_message", default=None)
+_lock = threading.Lock()
+# folded stack -> number of samples
+_stacks = {}
+# min-heap of (total, seq, label, stages), keeps PROFILE_TOP_N slowest messages
+_slowest = []
+_seq = itertools.count()
+_sampler = None
+_sampler_stop = None
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _Noop()
+
+class _Stage:
+    __slots__ = ("stages", "name", "start")
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stages[self.name] = self.stages.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+class _Message:
+    __slots__ = ("label", "stages", "start", "token")
+
+    def __init__(self, label):
+        self.label = label
+        self.stages = {}
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        total = time.perf_counter() - self.start
+        _current.reset(self.token)
+        _record(total, self.label, self.stages)
+        return False
+
+# --- HOOKS ---
+
+def message(label):
+    """
+    Profile one incoming message: stages inside are attributed to it
+    """
+    if not _enabled:
+        return _NOOP
+    return _Message(label)
+
+def stage(name):
+    """
+    Time a stage of the current message (time of repeated stages is summed)
+    """
+    if not _enabled:
+        return _NOOP
+    current = _current.get()
+    if current is None:
+        return _NOOP
+    return _Stage(current.stages, name)
+
+def annotate(label):
+    """
+    Replace the label of the current message (e.g. once the channel is known)
+    """
+    if _enabled:
+        current = _current.get()
+        if current is not None:
+            current.label = label
+
+def _record(total, label, stages):
+    item = (total, next(_seq), label, stages)
+    with _lock:
+        if len(_slowest) < config.PROFILE_TOP_N:
+            heapq.heappush(_slowest, item)
+        else:
+            heapq.heappushpop(_slowest, item)
+
+# --- STACK SAMPLER ---
+
+def _sample_loop(stop, previous):
+    # a sampler stopped by disable() may still be writing its final dump
+    if previous is not None:
+        previous.join()
+    me = threading.get_ident()
+    next_dump = time.monotonic() + config.PROFILE_DUMP_INTERVAL
+    while not stop.wait(config.PROFILE_INTERVAL):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(stack))
+            with _lock:
+                _stacks[key] = _stacks.get(key, 0) + 1
+
+        if time.monotonic() >= next_dump:
+            dump()
+            next_dump = time.monotonic() + config.PROFILE_DUMP_INTERVAL
+    dump()
+
+def dump():
+    """
+    Write collected stacks to PROFILE_DIR/stacks-<time>.folded
+    and the slowest messages to PROFILE_DIR/slowest.log
+    """
+    with _lock:
+        stacks = dict(_stacks)
+        _stacks.clear()
+        slowest = sorted(_slowest, reverse=True)
+
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if stacks:
+        with open(os.path.join(config.PROFILE_DIR, f"stacks-{stamp}.folded"), "w", encoding="utf-8") as f:
+            for key, count in stacks.items():
+                f.write(f"{key} {count}\n")
+
+    with open(os.path.join(config.PROFILE_DIR, "slowest.log"), "w", encoding="utf-8") as f:
+        f.write(f"# {len(slowest)} slowest messages at {stamp}, seconds\n")
+        for total, _, label, stages in slowest:
+            breakdown = " ".join(f"{name}={seconds:.3f}" for name, seconds in sorted(stages.items(), key=lambda x: -x[1]))
+            f.write(f"{total:8.3f}  {label}  {breakdown}\n")
+
+# --- SWITCHES ---
+
+def enable():
+    global _enabled, _sampler, _sampler_stop
+    if _enabled:
+        return
+    _enabled = True
+    _sampler_stop = threading.Event()
+    # the new sampler waits for the old one itself, so the event loop is never blocked
+    _sampler = threading.Thread(target=_sample_loop, args=(_sampler_stop, _sampler), name="profiler", daemon=True)
+    _sampler.start()
+    log.info("Profiler enabled, dumps go to %s", config.PROFILE_DIR)
+
+def disable():
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+    # the sampler writes its final dump and exits on its own
+    _sampler_stop.set()
+    log.info("Profiler disabled")
+
+def toggle():
+    if _enabled:
+        disable()
+    else:
+        enable()
+
+def install():
+    """
+    Enable the profiler if PROFILE is set and toggle it on SIGUSR2 (not available on Windows).
+    Must be called from the running event loop
+    """
+    if config.PROFILE:
+        enable()
+    if hasattr(signal, "SIGUSR2"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, toggle)
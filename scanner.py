@@ -1,23 +1,24 @@
 import asyncio
+import logging
+import time
 from telethon import TelegramClient, events
 import config
 import database as db
-from filter_engine import FilterEngine
+import metrics
+import profiler
+from filter_engine import FilterEngine, clean_text
+
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
+log = logging.getLogger("scanner")
+
+STARTED_AT = time.perf_counter()
+first_message_done = False
 
 # Using the scanner session
-client = TelegramClient("scanner_session", config.API_ID, config.API_HASH)
+client = TelegramClient(config.SCANNER_SESSION, config.API_ID, config.API_HASH)
+# models are loaded in the background from main()
 engine = FilterEngine()
 
-def clean_text(text):
-    """
-    Guard against Unicode issues by cleaning the text
-    """
-    if not text: return ""
-    try:
-        return text.encode('utf-8', 'ignore').decode('utf-8')
-    except:
-        return ""
-
 @client.on(events.NewMessage(incoming=True))
 async def handler(event):
     """
@@ -25,47 +26,67 @@ async def handler(event):
     apply filters and deduplication,
     and queue notifications for users.
     """
+    with profiler.message(event.id):
+        await process_event(event)
 
-    chat = await event.get_chat()
+async def process_event(event):
+    start = time.perf_counter()
+    with profiler.stage("get_chat"):
+        chat = await event.get_chat()
     
     if not chat.username:
+        metrics.EVENTS.inc(result="no_username")
         return
         
     chat_username = chat.username.lower()
+    profiler.annotate(f"@{chat_username}/{event.id}")
 
     # check whether any user from the database requests news from this sourse
-    subscribers = await db.get_users_for_source(chat_username)
+    with profiler.stage("db"):
+        subscribers = await db.get_users_for_source(chat_username)
     
     if not subscribers: 
+        metrics.EVENTS.inc(result="no_subscribers")
         return
 
     text = event.text or event.message.message
     text = clean_text(text)    
-    if not text: return
+    if not text:
+        metrics.EVENTS.inc(result="empty")
+        return
 
+    # events arriving while models are still loading wait here
+    with profiler.stage("wait_models"):
+        await engine.wait_ready()
+
+    metrics.EVENTS.inc(result="processed")
     # debug with scores
-    print(f">>> [SCANNER] Message at @{chat_username}")
-    print(f"Message: {text[:50]}...")
+    log.debug(">>> [SCANNER] Message at @%s", chat_username)
+    log.debug("Message: %s...", text[:50])
+
+    # one evaluation plan for all subscribers of the source
+    with profiler.stage("db"):
+        filters_by_user = await db.get_filters_for_source(chat_username)
+    prepared, matches = await engine.process_source_message(text, filters_by_user)
 
-    for user_id in subscribers:
-        # check filters
-        filters = await db.get_user_filters(user_id)
-        matched, reason = await engine.process_message(text, filters)
+    for user_id, reason in matches:
+        # --- DUP CHECK ---
+        log.debug("   -> Preliminary match. Check for duplicates for user %s...", user_id)
         
-        if matched:
-            # --- DUP CHECK ---
-            print(f"   -> Preliminary match. Check for duplicates for user {user_id}...")
-            
+        with profiler.stage("db"):
             history = await db.get_user_history(user_id)
-            is_dup = await engine.is_duplicate(text, history)
+        is_dup = await engine.is_duplicate(prepared, history)
+        
+        if is_dup:
+            log.debug("   -> CANCELLED. Duplicate detected.")
+            metrics.MATCHES.inc(result="duplicate")
+        else:
+            log.debug("   -> ACCEPTED. Queuing notification.")
+            metrics.MATCHES.inc(result="queued")
             
-            if is_dup:
-                print(f"   -> CANCELLED. Duplicate detected.")
-            else:
-                print(f"   -> ACCEPTED. Queuing notification.")
-                
-                link = f"https://t.me/{chat_username}/{event.id}"
-                
+            link = f"https://t.me/{chat_username}/{event.id}"
+            
+            with profiler.stage("db"):
                 # queue notification
                 await db.add_notification(user_id, text, chat_username, reason, link)
                 
@@ -74,12 +95,27 @@ async def handler(event):
 
     # history cleanup occasionally
     if event.id % 50 == 0:
-        await db.cleanup_history()
+        with profiler.stage("db"):
+            await db.cleanup_history()
+
+    metrics.HANDLER_SECONDS.observe(time.perf_counter() - start)
+
+    global first_message_done
+    if not first_message_done:
+        first_message_done = True
+        log.info("First message processed %.1f s after start.", time.perf_counter() - STARTED_AT)
 
 async def main():
     await db.init_db()
-    print("Run SCANNER.PY")
+    await metrics.start_exporter("scanner")
+    profiler.install()
+    log.info("Run SCANNER.PY")
+    # load models while the client connects and starts receiving events
+    loading = engine.start_loading()
     await client.start()
+    log.info("Client connected %.1f s after start.", time.perf_counter() - STARTED_AT)
+    await loading
+    log.info("Models ready %.1f s after start.", time.perf_counter() - STARTED_AT)
     await client.run_until_disconnected()
 
 if __name__ == "__main__":